@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 import sys
+import traceback
 
 sys.path.append("./importers")
 from CSVImporter import Col, Importer, Drcr
+from beancount.ingest import cache, extract, identify
 
 currency = "CNY"
 
@@ -89,3 +91,40 @@ alipay_importer = Importer(
 )
 
 CONFIG = [wechat_importer, alipay_importer]
+
+
+def _extract_one(filename):
+    """Extract a bill with every importer in CONFIG that identifies it.
+
+    Returns:
+      A pair of the filename and a list of the entries of each identifying
+      importer, like bean-extract. An importer which raises is reported on
+      stderr and left out.
+    """
+    file = cache.get_file(filename)
+    extracted = []
+    for importer in CONFIG:
+        try:
+            if importer.identify(file):
+                extracted.append(extract.extract_from_file(filename, importer))
+        except Exception:
+            sys.stderr.write(
+                "Importer {} raised an unexpected error on {}:\n".format(
+                    importer.name(), filename
+                )
+            )
+            traceback.print_exc()
+    return filename, extracted
+
+
+if __name__ == "__main__":
+    # Batch entry point: extract the bills given on the command line in a process pool.
+    from concurrent.futures import ProcessPoolExecutor
+
+    sys.stdout.write(extract.HEADER)
+    with ProcessPoolExecutor() as executor:
+        for filename, extracted in executor.map(_extract_one, sys.argv[1:]):
+            for entries in extracted:
+                sys.stdout.write(identify.SECTION.format(filename))
+                sys.stdout.write("\n")
+                extract.print_extracted_entries(entries, sys.stdout)
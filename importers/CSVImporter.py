@@ -6,7 +6,9 @@ __license__ = "MIT"
 import sys
 import csv
 import datetime
+import decimal
 import enum
+import functools
 import io
 import re
 import os
@@ -16,6 +18,11 @@ from typing import Union, Dict, Callable, Optional
 
 import dateutil.parser
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 from beancount.core import data
 from beancount.core.amount import Amount
 from beancount.core.number import D
@@ -78,6 +85,24 @@ class Drcr(enum.Enum):
     UNCERTAINTY = "[UNCERTAINTY]"
 
 
+# Currency symbols, thousands separators and blanks around a plain amount.
+_AMOUNT_DELETE = str.maketrans("", "", "¥￥$, \t")
+_AMOUNT_RE = re.compile(r"\d+\.?\d*")
+
+# The account_map sections every importer needs.
+_ACCOUNT_SECTIONS = ("assets", "debit", "credit")
+
+# The maximum number of memoized keywords per account_map section.
+_ACCOUNT_CACHE_SIZE = 10000
+
+# The maximum number of files whose normalized configuration is memoized.
+_NORMALIZE_CACHE_SIZE = 128
+
+# Characters which make an account keywords string more than "|" separated literals.
+_REGEX_SPECIAL = frozenset(".^$*+?{}[]\\()")
+
+
+@functools.lru_cache(maxsize=8192)
 def cast_to_decimal(amount: str):
     """Cast the amount to either an instance of Decimal or None.
 
@@ -85,25 +110,48 @@ def cast_to_decimal(amount: str):
         amount: A string of amount. The format may be '¥1,000.00', '5.20', '200'
     Returns:
         The corresponding Decimal of amount.
+    Raises:
+        ValueError: If the amount does not hold exactly one number.
     """
     if amount is None:
         return None
-    amount = "".join(amount.split(","))
-    numbers = re.findall(r"\d+\.?\d*", amount)
-    assert len(numbers) == 1
+    # The currency symbol, commas and sign are dropped; DRCR gives the direction.
+    number = amount.translate(_AMOUNT_DELETE).lstrip("+-")
+    try:
+        value = decimal.Decimal(number)
+    except decimal.InvalidOperation:
+        value = None
+    if value is not None and value.is_finite():
+        return value
+    # Allow other text around the number, like a currency code, but only one number.
+    numbers = _AMOUNT_RE.findall(number)
+    if len(numbers) != 1:
+        raise ValueError("Invalid amount: {!r}".format(amount))
     return D(numbers[0])
 
 
-def strip_blank(contents):
-    """ 
-    strip the redundant blank in file contents.
+@functools.lru_cache(maxsize=4096)
+def _parse_date(date_str: str):
+    """Parse a date string, memoized since bills repeat the same dates a lot."""
+    return parse_date_liberally(date_str)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_time(time_str: str):
+    """Parse the time of a date time string, memoized like _parse_date."""
+    return str(dateutil.parser.parse(time_str).time())
+
+
+def iter_stripped_rows(contents):
+    """Iterate over the rows of csv contents, with the blank around each field stripped.
+
+    Args:
+      contents: A string, the csv file contents.
+    Yields:
+      A list of stripped field strings for each row.
     """
-    with io.StringIO(contents) as csvfile:
-        csvreader = csv.reader(csvfile, delimiter=",", quotechar='"')
-        rows = []
-        for row in csvreader:
-            rows.append(",".join(['"{}"'.format(x.strip()) for x in row]))
-        return "\n".join(rows)
+    for row in csv.reader(io.StringIO(contents)):
+        yield [x.strip() for x in row]
 
 
 def get_amounts(
@@ -134,17 +182,16 @@ def get_amounts(
             for col in [Col.AMOUNT_DEBIT, Col.AMOUNT_CREDIT]
         ]
 
+    # Parse each side only once.
+    debit = cast_to_decimal(debit) if debit else None
+    credit = cast_to_decimal(credit) if credit else None
+
     # If zero amounts aren't allowed, return null value.
-    is_zero_amount = (credit is not None and cast_to_decimal(credit) == ZERO) and (
-        debit is not None and cast_to_decimal(debit) == ZERO
-    )
+    is_zero_amount = credit == ZERO and debit == ZERO
     if not allow_zero_amounts and is_zero_amount:
         return (None, None)
 
-    return (
-        -cast_to_decimal(debit) if debit else None,
-        cast_to_decimal(credit) if credit else None,
-    )
+    return (-debit if debit is not None else None, credit)
 
 
 def get_DRCR_status(iconfig: [Col, str], row, drcr_dict):
@@ -179,7 +226,8 @@ class Importer(importer.ImporterProtocol):
         skip_lines: int = 0,
         drcr_dict: Optional[Dict] = None,
         refund_keyword=None,
-        account_map: Dict = {},
+        account_map: Optional[Dict] = None,
+        has_header: Optional[bool] = True,
     ):
         """Constructor.
 
@@ -192,6 +240,10 @@ class Importer(importer.ImporterProtocol):
           drcr_dict: A dict to determine whether a transcation is credit or debit.
           refund_keyword: The keyword to determine whether a transaction is a refund.
           account_map: A dict to find the account corresponding to the transactions.
+            Required: it must have "assets", "debit" and "credit" sections, each
+            of them a dict with a "DEFAULT" account.
+          has_header: Whether the file has a header line after the skipped lines.
+            None to sniff it from the file.
         """
 
         assert isinstance(config, dict), "Invalid type: {}".format(config)
@@ -202,31 +254,95 @@ class Importer(importer.ImporterProtocol):
         self.skip_lines = skip_lines
         self.drcr_dict = drcr_dict
         self.refund_keyword = refund_keyword
+        for section in _ACCOUNT_SECTIONS:
+            if section not in (account_map or {}):
+                raise ValueError(
+                    "account_map has no {!r} section: {}".format(section, account_map)
+                )
+            if "DEFAULT" not in account_map[section]:
+                raise ValueError(
+                    "account_map[{!r}] has no 'DEFAULT' account".format(section)
+                )
         self.account_map = account_map
+        self.has_header = has_header
+        # Keywords recur a lot across rows, so memoize the mapping per section.
+        self._account_mappers = {
+            section: functools.lru_cache(maxsize=_ACCOUNT_CACHE_SIZE)(
+                functools.partial(mapping_account, compile_account_map(keywords))
+            )
+            for section, keywords in account_map.items()
+        }
+        # Every posting maps an assets account, so look that section up once.
+        self._assets_mapper = self._account_mappers["assets"]
+        self._assets_default = account_map["assets"]["DEFAULT"]
         self.file_name_prefix = file_name_prefix
+        # A cache of file name to the normalized configuration of that file.
+        self._normalized = {}
+
+    def _normalize(self, file):
+        """Normalize the configuration against the header of the file, once per file.
+
+        identify, file_date and extract are all called on the same file, so the
+        result of normalize_config is memoized by file name.
+
+        Args:
+          file: A cache._FileMemo instance.
+        Returns:
+          The pair returned by normalize_config.
+        """
+        try:
+            return self._normalized[file.name]
+        except KeyError:
+            pass
+        if len(self._normalized) >= _NORMALIZE_CACHE_SIZE:
+            self._normalized.clear()
+        result = self._normalized[file.name] = normalize_config(
+            self.config, file.contents(), self.skip_lines, self.has_header
+        )
+        return result
+
+    def _prepare(self, file):
+        """Read the file contents once and normalize the configuration against them.
+
+        Args:
+          file: A cache._FileMemo instance.
+        Returns:
+          A tuple of
+            an iterator of stripped rows, as returned by iter_stripped_rows,
+            a dict of Col types to integer indexes of the fields, and
+            a boolean, true if the file has a header.
+        """
+        iconfig, has_header = self._normalize(file)
+        return iter_stripped_rows(file.contents()), iconfig, has_header
 
     def file_date(self, file):
         "Get the maximum date from the file."
-        iconfig, has_header = normalize_config(
-            self.config, file.contents(), self.skip_lines
-        )
+        reader, iconfig, has_header = self._prepare(file)
         if Col.DATE in iconfig:
-            reader = csv.reader(open(io.StringIO(strip_blank(file.contents()))))
             for _ in range(self.skip_lines):
                 next(reader)
             if has_header:
                 next(reader)
-            max_date = None
+
+            # Like extract, rely on the file being sorted by date: only the
+            # first and the last rows can hold the maximum date.
+            first_row = last_row = None
             for row in reader:
                 if not row:
                     continue
                 if row[0].startswith("#"):
                     continue
-                date_str = row[iconfig[Col.DATE]]
-                date = parse_date_liberally(date_str, self.dateutil_kwds)
-                if max_date is None or date > max_date:
-                    max_date = date
-            return max_date
+                if row[0].startswith("-----------"):
+                    break
+                if first_row is None:
+                    first_row = row
+                last_row = row
+            if first_row is None:
+                return None
+            return max(
+                _parse_date(first_row[iconfig[Col.DATE]]),
+                _parse_date(last_row[iconfig[Col.DATE]]),
+            )
 
     def identify(self, file: cache._FileMemo):
         if file.mimetype() != "text/csv":
@@ -234,18 +350,14 @@ class Importer(importer.ImporterProtocol):
         if not os.path.basename(file.name).startswith(self.file_name_prefix):
             return False
 
-        iconfig, _ = normalize_config(self.config, file.contents(), self.skip_lines)
+        iconfig, _ = self._normalize(file)
         return len(iconfig) == len(self.config)
 
     def extract(self, file, existing_entries=None):
         entries = []
 
         # Normalize the configuration to fetch by index.
-        iconfig, has_header = normalize_config(
-            self.config, file.contents(), self.skip_lines
-        )
-
-        reader = csv.reader(io.StringIO(strip_blank(file.contents())))
+        reader, iconfig, has_header = self._prepare(file)
 
         # Skip garbage lines
         for _ in range(self.skip_lines):
@@ -255,8 +367,17 @@ class Importer(importer.ImporterProtocol):
         if has_header:
             next(reader)
 
-        def get(row, ftype):
-            return row[iconfig[ftype]] if ftype in iconfig else None
+        # The column indexes are fixed for the whole file, look them up once.
+        idx_date = iconfig.get(Col.DATE)
+        idx_txn_date = iconfig.get(Col.TXN_DATE)
+        idx_txn_time = iconfig.get(Col.TXN_TIME)
+        idx_account = iconfig.get(Col.ACCOUNT)
+        idx_type = iconfig.get(Col.TYPE)
+        idx_payee = iconfig.get(Col.PAYEE)
+        idx_narration = iconfig.get(Col.NARRATION)
+
+        assets_mapper = self._assets_mapper
+        assets_default = self._assets_default
 
         # Parse all the transactions.
         first_row = last_row = None
@@ -273,29 +394,22 @@ class Importer(importer.ImporterProtocol):
             last_row = row
 
             # Extract the data we need from the row, based on the configuration.
-            status = get(row, Col.STATUS)
-            date = get(row, Col.DATE)
-            txn_date = get(row, Col.TXN_DATE)
-            txn_time = get(row, Col.TXN_TIME)
-            account = get(row, Col.ACCOUNT)
-            tx_type = get(row, Col.TYPE)
+            date = row[idx_date] if idx_date is not None else None
+            txn_date = row[idx_txn_date] if idx_txn_date is not None else None
+            txn_time = row[idx_txn_time] if idx_txn_time is not None else None
+            account = row[idx_account] if idx_account is not None else None
+            tx_type = row[idx_type] if idx_type is not None else None
+            payee = row[idx_payee] if idx_payee is not None else None
+            narration = row[idx_narration] if idx_narration is not None else None
             tx_type = tx_type or ""
 
-            payee = get(row, Col.PAYEE)
-            if payee:
-                payee = payee.strip()
-
-            narration = get(row, Col.NARRATION)
-            if narration:
-                narration = narration.strip()
-
             # Create a transaction
             meta = data.new_metadata(file.name, index)
             if txn_date is not None:
-                meta["date"] = parse_date_liberally(txn_date)
+                meta["date"] = _parse_date(txn_date)
             if txn_time is not None:
-                meta["time"] = str(dateutil.parser.parse(txn_time).time())
-            date = parse_date_liberally(date)
+                meta["time"] = _parse_time(txn_time)
+            date = _parse_date(date)
             txn = data.Transaction(
                 meta,
                 date,
@@ -315,6 +429,16 @@ class Importer(importer.ImporterProtocol):
             if amount_debit is None and amount_credit is None:
                 continue
 
+            # The secondary account keyword depends only on the row, not on
+            # which amount is being posted.
+            payee_narration = (payee or "") + (narration or "")
+            is_refund = (
+                bool(self.refund_keyword) and self.refund_keyword in payee_narration
+            )
+            secondary_mapper = self._account_mappers[
+                "credit" if drcr == Drcr.CREDIT and not is_refund else "debit"
+            ]
+
             for amount in [amount_debit, amount_credit]:
                 if amount is None:
                     continue
@@ -323,12 +447,8 @@ class Importer(importer.ImporterProtocol):
                 if drcr == Drcr.UNCERTAINTY:
                     if account and len(account.split("-")) == 2:
                         accounts = account.split("-")
-                        primary_account = mapping_account(
-                            self.account_map["assets"], accounts[1]
-                        )
-                        secondary_account = mapping_account(
-                            self.account_map["assets"], accounts[0]
-                        )
+                        primary_account = assets_mapper(accounts[1])
+                        secondary_account = assets_mapper(accounts[0])
                         txn.postings.append(
                             data.Posting(
                                 primary_account, -units, None, None, None, None
@@ -342,7 +462,7 @@ class Importer(importer.ImporterProtocol):
                     else:
                         txn.postings.append(
                             data.Posting(
-                                self.account_map["assets"]["DEFAULT"],
+                                assets_default,
                                 units,
                                 None,
                                 None,
@@ -351,27 +471,12 @@ class Importer(importer.ImporterProtocol):
                             )
                         )
                 else:
-                    primary_account = mapping_account(
-                        self.account_map["assets"], account
-                    )
+                    primary_account = assets_mapper(account)
                     txn.postings.append(
                         data.Posting(primary_account, units, None, None, None, None)
                     )
 
-                    payee_narration = payee + narration
-                    account_map = self.account_map[
-                        "credit"
-                        if drcr == Drcr.CREDIT
-                        and not (
-                            self.refund_keyword
-                            and payee_narration.find(self.refund_keyword) != -1
-                        )
-                        else "debit"
-                    ]
-
-                    secondary_account = mapping_account(
-                        account_map, payee_narration + tx_type
-                    )
+                    secondary_account = secondary_mapper(payee_narration + tx_type)
                     txn.postings.append(
                         data.Posting(secondary_account, None, None, None, None, None)
                     )
@@ -381,19 +486,19 @@ class Importer(importer.ImporterProtocol):
             entries.append(txn)
 
         # Figure out if the file is in ascending or descending order.
-        first_date = parse_date_liberally(get(first_row, Col.DATE))
-        last_date = parse_date_liberally(get(last_row, Col.DATE))
+        first_date = _parse_date(first_row[iconfig[Col.DATE]])
+        last_date = _parse_date(last_row[iconfig[Col.DATE]])
         is_ascending = first_date < last_date
 
         # Reverse the list if the file is in descending order
         if not is_ascending:
-            entries = list(reversed(entries))
+            entries.reverse()
 
         # Add a balance entry if possible
         if Col.BALANCE in iconfig and entries:
             entry = entries[-1]
             date = entry.date + datetime.timedelta(days=1)
-            balance = entry.meta.get("balance", None)
+            balance = entry.meta.pop("balance", None)
             if balance is not None:
                 meta = data.new_metadata(file.name, index)
                 entries.append(
@@ -402,14 +507,12 @@ class Importer(importer.ImporterProtocol):
                     )
                 )
 
-        # Remove the 'balance' metadata.
-        for entry in entries:
-            entry.meta.pop("balance", None)
-
         return entries
 
 
-def normalize_config(config, head, skip_lines: int = 0):
+def normalize_config(
+    config, head, skip_lines: int = 0, has_header: Optional[bool] = None
+):
     """Using the header line, convert the configuration field name lookups to int indexes.
 
     Args:
@@ -417,6 +520,7 @@ def normalize_config(config, head, skip_lines: int = 0):
       head: A string, some decent number of bytes of the head of the file.
       dialect: A dialect definition to parse the header
       skip_lines: Skip first x (garbage) lines of file.
+      has_header: Whether the file has a header line. None to sniff it.
     Returns:
       A pair of
         A dict of Col types to integer indexes of the fields, and
@@ -428,17 +532,22 @@ def normalize_config(config, head, skip_lines: int = 0):
     # Skip garbage lines before sniffing the header
     assert isinstance(skip_lines, int)
     assert skip_lines >= 0
+    # Only the header line is sliced out, to avoid copying the whole contents.
+    start = 0
     for _ in range(skip_lines):
-        head = head[head.find("\n") + 1 :]
-    head = head[: head.find("\n") + 1]
-
-    head = strip_blank(head)
-    has_header = csv.Sniffer().has_header(head)
+        newline = head.find("\n", start)
+        if newline != -1:
+            start = newline + 1
+    head = head[start : head.find("\n", start) + 1]
+
+    header = next(iter_stripped_rows(head), [])
+    if has_header is None:
+        # Sniff the header line with every field quoted, to pin down the delimiter.
+        has_header = csv.Sniffer().has_header(
+            ",".join('"{}"'.format(field_name) for field_name in header)
+        )
     if has_header:
-        header = next(csv.reader(io.StringIO(head)))
-        field_map = {
-            field_name.strip(): index for index, field_name in enumerate(header)
-        }
+        field_map = {field_name: index for index, field_name in enumerate(header)}
         index_config = {}
         for field_type, field in config.items():
             if isinstance(field, str):
@@ -453,24 +562,103 @@ def normalize_config(config, head, skip_lines: int = 0):
     return index_config, has_header
 
 
-def mapping_account(account_map, keyword):
-    """Finding which key of account_map contains the keyword, return the corresponding value.
+def _literal_keywords(account_keywords):
+    """Split an account keywords string into its keywords, if they are all literal.
+
+    Args:
+      account_keywords: An account keywords string (each keyword separated by "|").
+    Return:
+      A list of keyword strings, or None if the string uses any other regex syntax.
+    """
+    keywords = account_keywords.split("|")
+    if all(keywords) and not any(_REGEX_SPECIAL.intersection(k) for k in keywords):
+        return keywords
+    return None
+
+
+def _compile_regex(items):
+    """Compile (account keywords string, account name) items into a regex matcher.
+
+    The keys are tried in the given order, so the first matching key wins. A key
+    also matches when the keyword equals the account keywords string literally.
+    """
+    patterns = [
+        (account_keywords, re.compile(account_keywords), account_name)
+        for account_keywords, account_name in items
+    ]
+
+    def match(keyword):
+        for account_keywords, pattern, account_name in patterns:
+            if pattern.search(keyword) or account_keywords == keyword:
+                return account_name
+        return None
+
+    return match
+
+
+def _compile_automaton(items, literals):
+    """Build an Aho-Corasick matcher over the literal keywords of the items.
+
+    Every keyword is stored with the position of its key, and the matched key
+    with the lowest position wins, like the regex matcher.
+    """
+    automaton = ahocorasick.Automaton()
+    for index, ((_, account_name), keywords) in enumerate(zip(items, literals)):
+        for keyword in keywords:
+            if keyword not in automaton:
+                automaton.add_word(keyword, (index, account_name))
+    automaton.make_automaton()
+
+    def match(keyword):
+        found = min((value for _, value in automaton.iter(keyword)), default=None)
+        return found[1] if found else None
+
+    return match
+
+
+def compile_account_map(account_map):
+    """Compile the keywords of an account map into a single matcher.
+
+    When pyahocorasick is installed and every keyword is a literal string, the
+    keywords are matched by one Aho-Corasick automaton. Otherwise each key is
+    compiled into its own regular expression.
 
     Args:
       account_map: A dict of account keywords string (each keyword separated by "|") to account name.
-      keyword: A keyword string.
     Return:
-      An account name string.
+      A pair of
+        a callable from a keyword string to the matched account name or None
+        (None if there are no keywords), and
+        the default account name.
     Raises:
       KeyError: If "DEFAULT" keyword is not in account_map.
     """
     if "DEFAULT" not in account_map:
-        raise KeyError("DEFAULT is not in " + account_map.__str__)
-    account_name = account_map["DEFAULT"]
-    for account_keywords in account_map.keys():
-        if account_keywords == "DEFAULT":
-            continue
-        if re.search(account_keywords, keyword) or account_keywords == keyword:
-            account_name = account_map[account_keywords]
-            break
-    return account_name
+        raise KeyError("DEFAULT is not in {}".format(account_map))
+    items = [
+        (account_keywords, account_name)
+        for account_keywords, account_name in account_map.items()
+        if account_keywords != "DEFAULT"
+    ]
+    literals = [_literal_keywords(account_keywords) for account_keywords, _ in items]
+    if not items:
+        match = None
+    elif ahocorasick is not None and all(k is not None for k in literals):
+        match = _compile_automaton(items, literals)
+    else:
+        match = _compile_regex(items)
+    return match, account_map["DEFAULT"]
+
+
+def mapping_account(compiled_account_map, keyword):
+    """Finding which key of compiled_account_map matches the keyword, return its account.
+
+    Args:
+      compiled_account_map: A compiled account map, as returned by compile_account_map.
+      keyword: A keyword string.
+    Return:
+      An account name string.
+    """
+    match, default_account = compiled_account_map
+    account_name = match(keyword) if match is not None else None
+    return account_name if account_name is not None else default_account
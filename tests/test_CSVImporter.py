@@ -0,0 +1,173 @@
+import datetime
+import os
+import sys
+
+import pytest
+from beancount.core.number import D
+from beancount.ingest import cache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "importers"))
+import CSVImporter
+from CSVImporter import (
+    Col,
+    Importer,
+    cast_to_decimal,
+    compile_account_map,
+    mapping_account,
+    normalize_config,
+)
+
+
+@pytest.fixture(params=["automaton", "regex"])
+def matcher(request, monkeypatch):
+    """Run a test against both the Aho-Corasick and the regex matcher."""
+    if request.param == "automaton" and CSVImporter.ahocorasick is None:
+        pytest.skip("pyahocorasick is not installed")
+    if request.param == "regex":
+        monkeypatch.setattr(CSVImporter, "ahocorasick", None)
+    return request.param
+
+
+def test_mapping_account_default(matcher):
+    compiled = compile_account_map({"DEFAULT": "Expenses:Unknown", "饿了么": "A"})
+    assert mapping_account(compiled, "全家") == "Expenses:Unknown"
+    assert mapping_account(compiled, "") == "Expenses:Unknown"
+
+
+def test_mapping_account_no_keywords(matcher):
+    compiled = compile_account_map({"DEFAULT": "Expenses:Unknown"})
+    assert mapping_account(compiled, "全家") == "Expenses:Unknown"
+
+
+def test_mapping_account_missing_default():
+    with pytest.raises(KeyError):
+        compile_account_map({"饿了么": "A"})
+
+
+def test_mapping_account_first_key_wins(matcher):
+    compiled = compile_account_map(
+        {"DEFAULT": "D", "自动宝|全家": "A", "饿了么": "B", "医院|全家": "C"}
+    )
+    # The first key in account_map order wins, not the leftmost match.
+    assert mapping_account(compiled, "医院饿了么") == "B"
+    assert mapping_account(compiled, "医院全家") == "A"
+    assert mapping_account(compiled, "医院") == "C"
+
+
+def test_mapping_account_regex_keys():
+    compiled = compile_account_map(
+        {"DEFAULT": "D", "(?i)abc": "A", r"(x)\1": "B", "^q|z$": "C"}
+    )
+    assert mapping_account(compiled, "xABCx") == "A"
+    assert mapping_account(compiled, "xx") == "B"
+    assert mapping_account(compiled, "qa") == "C"
+    assert mapping_account(compiled, "az") == "C"
+    assert mapping_account(compiled, "aq") == "D"
+
+
+def test_mapping_account_literal_equality():
+    # "a+b" does not match itself as a regex, but equals the keyword.
+    compiled = compile_account_map({"DEFAULT": "D", "a+b": "A", "b": "B"})
+    assert mapping_account(compiled, "a+b") == "A"
+    assert mapping_account(compiled, "aab") == "A"
+    assert mapping_account(compiled, "+b") == "B"
+
+
+@pytest.mark.parametrize(
+    "amount, expected",
+    [
+        ("¥1,000.00", "1000.00"),
+        ("5.20", "5.20"),
+        ("200", "200"),
+        ("-5.00", "5.00"),
+        ("1.0e2", "100"),
+        ("CNY 12.5", "12.5"),
+    ],
+)
+def test_cast_to_decimal(amount, expected):
+    assert cast_to_decimal(amount) == D(expected)
+
+
+@pytest.mark.parametrize("amount", ["¥12.00(含¥2.00)", "abc", "¥", "NaN"])
+def test_cast_to_decimal_invalid(amount):
+    with pytest.raises(ValueError, match="Invalid amount"):
+        cast_to_decimal(amount)
+
+
+ACCOUNT_MAP = {
+    "assets": {"DEFAULT": "Assets:Unknown"},
+    "debit": {"DEFAULT": "Expenses:Unknown"},
+    "credit": {"DEFAULT": "Income:Unknown"},
+}
+
+
+def test_importer_requires_account_map():
+    with pytest.raises(ValueError, match="'assets'"):
+        Importer({Col.DATE: 0}, "", "CNY", "x")
+    account_map = {k: v for k, v in ACCOUNT_MAP.items() if k != "credit"}
+    with pytest.raises(ValueError, match="'credit'"):
+        Importer({Col.DATE: 0}, "", "CNY", "x", account_map=account_map)
+    account_map = dict(ACCOUNT_MAP, debit={"饿了么": "Expenses:Food"})
+    with pytest.raises(ValueError, match="'debit'.*'DEFAULT'"):
+        Importer({Col.DATE: 0}, "", "CNY", "x", account_map=account_map)
+
+
+def make_bill(tmp_path, rows, name="bill_test.csv"):
+    """Write a bill with two garbage lines, a header, and a footer."""
+    lines = ["bill export,", "garbage,", "date,amount"]
+    lines += rows
+    lines.append("-----------------,")
+    lines.append("2099-01-01,footer")
+    path = tmp_path / name
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return cache._FileMemo(str(path))
+
+
+def make_importer(**kwargs):
+    config = {Col.DATE: "date", Col.AMOUNT: "amount"}
+    return Importer(config, "", "CNY", "bill", 2, account_map=ACCOUNT_MAP, **kwargs)
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        ["2021-06-01,1.00", "# 2021-07-01,", "2021-06-02,2.00", "2021-06-30,3.00"],
+        ["2021-06-30,3.00", "2021-06-02,2.00", "# 2021-07-01,", "2021-06-01,1.00"],
+    ],
+    ids=["ascending", "descending"],
+)
+def test_file_date(tmp_path, rows):
+    file = make_bill(tmp_path, rows)
+    assert make_importer().file_date(file) == datetime.date(2021, 6, 30)
+
+
+def test_file_date_no_rows(tmp_path):
+    file = make_bill(tmp_path, ["# 2021-07-01,"])
+    assert make_importer().file_date(file) is None
+
+
+def test_normalize_config_without_header():
+    config = {Col.DATE: 0, Col.AMOUNT: 1}
+    head = "garbage,\n2021-06-01,1.00\n"
+    assert normalize_config(config, head, 1, has_header=False) == (config, False)
+
+
+def test_normalize_config_without_header_named_fields():
+    config = {Col.DATE: "date", Col.AMOUNT: 1}
+    with pytest.raises(ValueError):
+        normalize_config(config, "2021-06-01,1.00\n", 0, has_header=False)
+
+
+def test_normalize_config_once_per_file(tmp_path, monkeypatch):
+    calls = []
+
+    def counting_normalize_config(*args):
+        calls.append(args)
+        return normalize_config(*args)
+
+    monkeypatch.setattr(CSVImporter, "normalize_config", counting_normalize_config)
+    file = make_bill(tmp_path, ["2021-06-01,1.00", "2021-06-02,2.00"])
+    importer = make_importer()
+    assert importer.identify(file)
+    assert len(importer.extract(file)) == 2
+    assert len(calls) == 1